@@ -1,121 +1,383 @@
 from fastmcp import FastMCP
+import httpx
 import asyncio
+import codecs
+import collections
+import importlib
+import itertools
 import time
 import os
+import signal
+import subprocess
+import sys
 from playwright.async_api import async_playwright
 
 mcp = FastMCP("ApplicationServer")
 
+class LogEntry:
+    """A captured browser console message."""
+    __slots__ = ("level", "message", "timestamp", "url")
+    
+    def __init__(self, level, message, timestamp, url):
+        self.level = level
+        self.message = message
+        self.timestamp = timestamp
+        self.url = url
+
+class AppProcess:
+    """Async view of a subprocess.Popen whose pipes are exposed as asyncio StreamReaders."""
+    
+    def __init__(self, popen, stdout, stderr, transports):
+        self._popen = popen
+        self.stdout = stdout
+        self.stderr = stderr
+        self._transports = transports
+    
+    @property
+    def pid(self):
+        return self._popen.pid
+    
+    @property
+    def returncode(self):
+        return self._popen.poll()
+    
+    def terminate(self):
+        self._signal_group("SIGTERM", self._popen.terminate)
+    
+    def kill(self):
+        self._signal_group("SIGKILL", self._popen.kill)
+    
+    def _signal_group(self, name, fallback):
+        # Signal the whole session so grandchildren (uvicorn's reload worker) don't outlive the app
+        if sys.platform == "win32":
+            fallback()
+            return
+        try:
+            os.killpg(self._popen.pid, getattr(signal, name))
+        except ProcessLookupError:
+            pass
+    
+    async def wait(self):
+        # Poll rather than block a thread so the wait stays cancellable
+        while self._popen.poll() is None:
+            await asyncio.sleep(0.05)
+        return self._popen.returncode
+    
+    def close(self):
+        """Close the pipe transports, ending the capture task even if a grandchild still holds the pipes."""
+        for transport in self._transports:
+            transport.close()
+
+class AsyncioAppProcess:
+    """AppProcess counterpart for Windows, backed by asyncio's own subprocess support."""
+    
+    def __init__(self, process):
+        self._process = process
+        self.stdout = process.stdout
+        self.stderr = process.stderr
+    
+    @property
+    def pid(self):
+        return self._process.pid
+    
+    @property
+    def returncode(self):
+        return self._process.returncode
+    
+    def terminate(self):
+        self._signal(self._process.terminate)
+    
+    def kill(self):
+        self._signal(self._process.kill)
+    
+    def _signal(self, send):
+        try:
+            send()
+        except ProcessLookupError:
+            pass
+    
+    async def wait(self):
+        return await self._process.wait()
+    
+    def close(self):
+        # asyncio owns the pipe transports and closes them when the process exits
+        pass
+
+async def _spawn(*args):
+    """Start a subprocess with Popen on a worker thread and wrap its pipes for asyncio.
+    
+    asyncio.create_subprocess_exec runs Popen on the event loop thread, which blocks
+    every other tool call until the child has exec'd. The child gets its own session
+    so the whole process group (e.g. uvicorn's reloader and worker) can be signalled.
+    
+    On Windows, connect_read_pipe cannot wrap Popen's anonymous pipes (the proactor loop
+    needs overlapped pipes), so asyncio's own subprocess support is used there instead."""
+    if sys.platform == "win32":
+        process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        return AsyncioAppProcess(process)
+    
+    popen = await asyncio.to_thread(
+        subprocess.Popen, args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        start_new_session=True
+    )
+    loop = asyncio.get_running_loop()
+    readers, transports = [], []
+    for pipe in (popen.stdout, popen.stderr):
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        readers.append(reader)
+        transports.append(transport)
+    return AppProcess(popen, *readers, transports)
+
 # Global variables to store the process and logs
 app_process = None
-server_logs = asyncio.Queue()
-console_logs = []
+server_logs = collections.deque(maxlen=500)
+console_logs = collections.deque(maxlen=100)
 browser = None
+context = None
 page = None
 playwright = None
+_browser_lock = asyncio.Lock()
+# Serializes start_app/stop_app so concurrent tool calls cannot double-start the app
+_lifecycle_lock = asyncio.Lock()
+# Serializes navigation and clicks so concurrent tool calls don't interleave on the page
+_page_lock = asyncio.Lock()
+# Limits browser tool calls on the single page; others queue for up to BROWSER_WAIT_TIMEOUT seconds
+MAX_BROWSER_CALLS = 1
+BROWSER_WAIT_TIMEOUT = 30.0
+_browser_sema = asyncio.Semaphore(MAX_BROWSER_CALLS)
+
+# Pooled HTTP client for probing the app server, reused across probes and restarts.
+# trust_env=False keeps HTTP(S)_PROXY from routing the localhost probe through a proxy.
+_http = httpx.AsyncClient(
+    limits=httpx.Limits(max_keepalive_connections=5, max_connections=10),
+    timeout=2.0,
+    trust_env=False
+)
+
+def _tail(buffer, n):
+    """Return the last n entries of a deque, oldest first, without copying the whole buffer."""
+    tail = list(itertools.islice(reversed(buffer), n))
+    tail.reverse()
+    return tail
+
+# Display names for the fixed set of console levels, so formatting skips str.upper()
+_LEVEL_UPPER = {"log": "LOG", "warning": "WARNING", "error": "ERROR", "info": "INFO", "debug": "DEBUG"}
+
+def _format_console_log(log):
+    """Format a LogEntry for display."""
+    # Timestamps are stored as epoch floats and only formatted for the entries shown
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(log.timestamp))
+    level = _LEVEL_UPPER.get(log.level) or log.level.upper()
+    return f"[{timestamp}] [{level}] {log.message} - {log.url}"
+
+async def _drain(stream):
+    """Read a subprocess stream in bulk chunks and append complete lines to the server logs."""
+    # Incremental decoding keeps multibyte characters intact across chunk boundaries
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    buffer = ""
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split('\n')
+        for line in lines:
+            server_logs.append(line.rstrip())
+    
+    # Flush the decoder and any trailing partial line
+    buffer += decoder.decode(b'', final=True)
+    if buffer:
+        server_logs.append(buffer.rstrip())
 
 async def capture_output(process):
-    """Capture output from a subprocess."""
-    async for line in process.stdout:
-        if line:
-            await server_logs.put(line.decode('utf-8').rstrip())
+    """Capture output from a subprocess, draining stdout and stderr concurrently."""
+    await asyncio.gather(_drain(process.stdout), _drain(process.stderr))
+
+# Injected into every page: wraps console methods and forwards them to _pyLog,
+# serializing in the browser so Python never marshals the JSHandle args
+CONSOLE_CAPTURE_SCRIPT = """
+(() => {
+    const fmt = (a) => {
+        if (typeof a === 'string') return a;
+        try { return typeof a === 'object' && a !== null ? JSON.stringify(a) : String(a); }
+        catch (e) { return String(a); }
+    };
+    const send = (level, message) => {
+        // _pyLog returns a Promise; swallow rejections (e.g. while the context closes)
+        try { window._pyLog({level, message, url: location.href}).catch(() => {}); } catch (e) {}
+    };
+    const levels = {log: 'log', info: 'info', warn: 'warning', error: 'error', debug: 'debug'};
+    for (const [method, level] of Object.entries(levels)) {
+        console[method] = new Proxy(console[method], {
+            apply: (target, thisArg, args) => {
+                send(level, args.map(fmt).join(' '));
+                return Reflect.apply(target, thisArg, args);
+            }
+        });
+    }
+})();
+"""
+
+async def _ensure_browser():
+    """Launch playwright and the browser once and reuse them across app restarts."""
+    global browser, playwright
     
-    async for line in process.stderr:
-        if line:
-            await server_logs.put(line.decode('utf-8').rstrip())
+    async with _browser_lock:
+        if browser is None or not browser.is_connected():
+            if playwright is None:
+                playwright = await async_playwright().start()
+            browser = await playwright.chromium.launch(headless=True)
+    return browser
 
 async def setup_browser_console_capture():
-    """Setup browser with console log capturing."""
-    global browser, page, playwright, console_logs
+    """Setup browser with console log capturing. Called from start_app with _lifecycle_lock held."""
+    global context, page, console_logs
     
-    # Launch playwright and browser
-    playwright = await async_playwright().start()
-    browser = await playwright.chromium.launch(headless=True)
-    page = await browser.new_page()
+    # Reuse the running browser; only the context and page are created per app start
+    await _ensure_browser()
+    context = await browser.new_context()
     
     # Clear previous console logs
     console_logs.clear()
     
-    # Add console event listener
-    def handle_console_message(msg):
-        log_entry = {
-            "level": msg.type,
-            "message": msg.text,
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-            "url": page.url,
-            "args": [str(arg) for arg in msg.args]
-        }
-        console_logs.append(log_entry)
-        # Keep only last 100 logs
-        if len(console_logs) > 100:
-            console_logs.pop(0)
-    
-    page.on("console", handle_console_message)
-    
-    # Also capture page errors
-    def handle_page_error(error):
-        log_entry = {
-            "level": "error",
-            "message": f"Page Error: {error}",
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-            "url": page.url,
-            "args": []
-        }
-        console_logs.append(log_entry)
-    
-    page.on("pageerror", handle_page_error)
+    # Receive console entries serialized in the page by the init script below
+    def handle_console_message(entry):
+        console_logs.append(LogEntry(
+            entry.get("level", "log"),
+            entry.get("message", ""),
+            time.time(),
+            entry.get("url", "")
+        ))
+    
+    # Exposed on the context so every page and frame reports through the same callback
+    await context.expose_function("_pyLog", handle_console_message)
+    await context.add_init_script(CONSOLE_CAPTURE_SCRIPT)
+    
+    # Uncaught exceptions are reported per page; there is no console listener, so
+    # Playwright never marshals console args for the calls the script already reports
+    def attach_listeners(new_page):
+        def handle_page_error(error):
+            console_logs.append(LogEntry("error", f"Page Error: {error}", time.time(), new_page.url))
+        
+        new_page.on("pageerror", handle_page_error)
+    
+    # Failed resource loads never reach console.* in JS, so record them from the network events
+    def handle_request_failed(request):
+        console_logs.append(LogEntry("error", f"Failed to load resource: {request.failure}", time.time(), request.url))
+    
+    def handle_response(response):
+        if response.status >= 400:
+            console_logs.append(LogEntry("error", f"Failed to load resource: the server responded with a status of {response.status}", time.time(), response.url))
+    
+    context.on("requestfailed", handle_request_failed)
+    context.on("response", handle_response)
+    context.on("page", attach_listeners)
+    page = await context.new_page()
     
     return True
 
+async def wait_for_server(host="127.0.0.1", port=5001, timeout=10.0):
+    """Poll until the app server answers HTTP requests or the timeout expires."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        if app_process is None or app_process.returncode is not None:
+            return False
+        # Any HTTP response means the server is up, even an error status from a broken route
+        try:
+            await _http.get(f"http://{host}:{port}/")
+            return True
+        except httpx.TransportError:
+            await asyncio.sleep(0.05)
+    return False
+
 @mcp.tool
 async def start_app() -> str:
     """Starts the fasthtml application subprocess."""
     global app_process
     
-    if app_process and app_process.returncode is None:
-        return "App is already running."
-    
-    # Start the FastHTML app
-    app_process = await asyncio.create_subprocess_exec(
-        "python", "main.py",
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
-    
-    # Start task to capture output
-    asyncio.create_task(capture_output(app_process))
+    async with _lifecycle_lock:
+        if app_process and app_process.returncode is None:
+            return "App is already running."
+        
+        # Release the pipes and browser page of a previous process that exited on its own
+        if app_process:
+            app_process.close()
+        await _discard_page()
+        
+        # Start the FastHTML app unbuffered so its output reaches the logs promptly
+        app_process = await _spawn("python", "-u", "main.py")
+        
+        # Start task to capture output
+        asyncio.create_task(capture_output(app_process))
+        
+        # Wait until the server responds instead of sleeping a fixed time
+        if not await wait_for_server():
+            # Don't leave a half-started process (or its orphaned workers) behind to block the next start_app
+            await _stop_process()
+            await _discard_page()
+            return "App failed to start: the server did not become ready on http://localhost:5001 and was stopped. Check get_server_logs() for details."
+        
+        # Setup browser for console capture
+        if await setup_browser_console_capture():
+            return "App started successfully. Server is running on http://localhost:5001 with browser console capture enabled."
+        else:
+            return "App started successfully. Server is running on http://localhost:5001 (browser console capture failed to initialize)."
+
+async def _stop_process():
+    """Terminate the app process group, escalating to SIGKILL, and release its pipes."""
+    global app_process
     
-    await asyncio.sleep(2)  # Give the server time to start
+    app_process.terminate()
+    try:
+        await asyncio.wait_for(app_process.wait(), timeout=3.0)
+    except asyncio.TimeoutError:
+        pass
+    # SIGKILL the group: forces down a server that ignored SIGTERM and any worker the reloader left behind
+    app_process.kill()
+    await app_process.wait()
+    app_process.close()
+    app_process = None
+
+async def _close_page_and_context(page, context):
+    """Close the page and its context, continuing past a failure in either."""
+    for target in (page, context):
+        if target:
+            try:
+                await target.close()
+            except Exception:
+                pass
+
+async def _discard_page():
+    """Close the current page and context and clear them, so stale listeners stop feeding console_logs."""
+    global context, page
     
-    # Setup browser for console capture
-    if await setup_browser_console_capture():
-        return "App started successfully. Server is running on http://localhost:5001 with browser console capture enabled."
-    else:
-        return "App started successfully. Server is running on http://localhost:5001 (browser console capture failed to initialize)."
+    # Both closes run in one shielded task so a cancelled caller can't skip either
+    try:
+        await asyncio.shield(_close_page_and_context(page, context))
+    finally:
+        page = None
+        context = None
 
 @mcp.tool
 async def stop_app() -> str:
     """Stops the fasthtml application."""
-    global app_process, browser, playwright
-    
-    if app_process and app_process.returncode is None:
-        app_process.terminate()
-        await app_process.wait()
-        app_process = None
-    
-    # Close browser if open
-    if browser:
-        await browser.close()
-        browser = None
-    
-    if playwright:
-        await playwright.stop()
-        playwright = None
+    global app_process
     
-    if app_process is None:
-        return "App stopped successfully."
-    else:
-        return "App is not running."
+    async with _lifecycle_lock:
+        if app_process and app_process.returncode is None:
+            await _stop_process()
+        
+        # Close the page and context but keep the browser alive for the next start
+        await _discard_page()
+        
+        if app_process is None:
+            return "App stopped successfully."
+        else:
+            return "App is not running."
 
 @mcp.tool
 async def get_console_logs() -> str:
@@ -128,53 +390,57 @@ async def get_console_logs() -> str:
     if not console_logs:
         return "No browser console logs captured yet. Use navigate_to() to visit pages and generate logs."
     
-    # Format logs for display
-    formatted_logs = []
-    for log in console_logs[-20:]:  # Last 20 logs
-        formatted_logs.append(
-            f"[{log.get('timestamp', 'N/A')}] [{log.get('level', 'log').upper()}] {log.get('message', '')} - {log.get('url', '')}"
-        )
-    
-    return "\n".join(formatted_logs)
+    # Format the last 20 logs for display
+    return "\n".join(_format_console_log(log) for log in _tail(console_logs, 20))
+
+async def _acquire_browser_slot():
+    """Wait for a browser slot, giving up after BROWSER_WAIT_TIMEOUT seconds."""
+    try:
+        await asyncio.wait_for(_browser_sema.acquire(), timeout=BROWSER_WAIT_TIMEOUT)
+        return True
+    except asyncio.TimeoutError:
+        return False
 
 @mcp.tool
-async def navigate_to(path: str = "/") -> str:
-    """Navigate the browser to a specific path in the application."""
+async def navigate_to(path: str = "/", selector: str = "") -> str:
+    """Navigate the browser to a specific path in the application, optionally waiting for a CSS selector."""
     global page
     
-    if not app_process or app_process.returncode is not None:
-        return "App is not running. Start the app first."
-    
-    if not page:
-        return "Browser is not initialized. Restart the app."
+    if not await _acquire_browser_slot():
+        return f"Browser stayed busy with other requests for {BROWSER_WAIT_TIMEOUT:.0f}s. Try again shortly."
     
     try:
-        url = f"http://localhost:5001{path}"
-        await page.goto(url, wait_until="networkidle")
-        await asyncio.sleep(1)  # Give time for any async operations
-        return f"Navigated to {url}"
-    except Exception as e:
-        return f"Failed to navigate: {str(e)}"
+        async with _page_lock:
+            if not app_process or app_process.returncode is not None:
+                return "App is not running. Start the app first."
+            
+            if not page:
+                return "Browser is not initialized. Restart the app."
+            
+            try:
+                url = f"http://localhost:5001{path}"
+                await page.goto(url, wait_until="domcontentloaded", timeout=10000)
+                if selector:
+                    await page.wait_for_selector(selector, timeout=5000)
+                return f"Navigated to {url}"
+            except Exception as e:
+                return f"Failed to navigate: {str(e)}"
+    finally:
+        _browser_sema.release()
 
 @mcp.tool
 async def get_server_logs() -> str:
     """Gets the application server logs from the fasthtml application."""
-    logs = []
-    
-    # Get all available logs from the queue
-    while not server_logs.empty():
-        try:
-            logs.append(await server_logs.get())
-        except:
-            break
-    
-    if not logs:
+    if not server_logs:
         if app_process and app_process.returncode is None:
             return "No new server logs. Server is running."
         else:
             return "No server logs. Server is not running."
     
-    return "\n".join(logs[-50:])  # Return last 50 lines
+    # Return the last 50 lines and drain the buffer
+    logs = "\n".join(_tail(server_logs, 50))
+    server_logs.clear()
+    return logs
 
 @mcp.tool
 async def get_app_status() -> str:
@@ -185,22 +451,106 @@ async def get_app_status() -> str:
     return "App is not running"
 
 @mcp.tool
-async def click_element(selector: str) -> str:
-    """Click an element on the page using a CSS selector."""
+async def click_element(selector: str, wait_for: str = "") -> str:
+    """Click an element on the page using a CSS selector, optionally waiting for a CSS selector to appear afterwards (e.g. an HTMX swap target)."""
     global page
     
-    if not app_process or app_process.returncode is not None:
-        return "App is not running. Start the app first."
+    if not await _acquire_browser_slot():
+        return f"Browser stayed busy with other requests for {BROWSER_WAIT_TIMEOUT:.0f}s. Try again shortly."
     
-    if not page:
-        return "Browser is not initialized. Restart the app."
+    try:
+        async with _page_lock:
+            if not app_process or app_process.returncode is not None:
+                return "App is not running. Start the app first."
+            
+            if not page:
+                return "Browser is not initialized. Restart the app."
+            
+            try:
+                # Watch for a main-frame navigation started or committed by the click
+                main_frame = page.main_frame
+                navigation = {"started": False, "committed": False}
+                
+                def handle_request(request):
+                    if request.is_navigation_request() and request.frame == main_frame:
+                        navigation["started"] = True
+                
+                def handle_navigated(frame):
+                    if frame == main_frame:
+                        navigation["committed"] = True
+                
+                page.on("request", handle_request)
+                page.on("framenavigated", handle_navigated)
+                try:
+                    await page.click(selector)
+                finally:
+                    page.remove_listener("request", handle_request)
+                    page.remove_listener("framenavigated", handle_navigated)
+                
+                # Only a navigating click waits for the new document, and a timeout there is reported.
+                # Clicks that don't navigate (e.g. HTMX swaps) return at once; use wait_for for those.
+                if navigation["started"] or navigation["committed"]:
+                    if not navigation["committed"]:
+                        await page.wait_for_event("framenavigated", predicate=lambda frame: frame == main_frame, timeout=10000)
+                    await page.wait_for_load_state("domcontentloaded", timeout=10000)
+                if wait_for:
+                    await page.wait_for_selector(wait_for, timeout=5000)
+                return f"Clicked element: {selector}"
+            except Exception as e:
+                return f"Failed to click element '{selector}': {str(e)}"
+    finally:
+        _browser_sema.release()
+
+# In-process app for probe_route, reloaded only when the package sources change
+_probe_app = None
+_probe_app_mtimes = None
+_probe_app_lock = asyncio.Lock()
+APP_PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "context_writer")
+
+def _source_mtimes():
+    """Modification times of the app package's Python sources."""
+    return {
+        entry.name: entry.stat().st_mtime_ns
+        for entry in os.scandir(APP_PACKAGE_DIR)
+        if entry.name.endswith(".py")
+    }
+
+def _load_app():
+    """Import the fasthtml app fresh, dropping cached context_writer modules so source edits take effect."""
+    for name in [m for m in sys.modules if m == "context_writer" or m.startswith("context_writer.")]:
+        del sys.modules[name]
+    # Same app object main.py imports and serves
+    return importlib.import_module("context_writer.main_app").app
+
+async def _get_probe_app():
+    """Return the cached app, re-importing it on a worker thread if its sources changed."""
+    global _probe_app, _probe_app_mtimes
     
+    # Serialized so concurrent probes never mutate sys.modules at the same time
+    async with _probe_app_lock:
+        if _probe_app is None or _source_mtimes() != _probe_app_mtimes:
+            _probe_app = await asyncio.to_thread(_load_app)
+            # Snapshot after importing: the package regenerates its sources via nbdev on import
+            _probe_app_mtimes = _source_mtimes()
+        return _probe_app
+
+@mcp.tool
+async def probe_route(path: str = "/") -> str:
+    """Fetch a route from the fasthtml app in-process, without starting the server or browser. Use for HTML/HTMX output that does not need JavaScript."""
     try:
-        await page.click(selector)
-        await asyncio.sleep(0.5)  # Give time for any async operations
-        return f"Clicked element: {selector}"
+        app = await _get_probe_app()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            r = await client.get(path)
+        return f"GET {path} -> {r.status_code}\n{r.text}"
     except Exception as e:
-        return f"Failed to click element '{selector}': {str(e)}"
+        return f"Failed to probe route '{path}': {str(e)}"
 
 if __name__ == "__main__":
-    mcp.run()
\ No newline at end of file
+    # Use uvloop where available (POSIX only); otherwise keep the default event loop
+    if sys.platform != "win32":
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            pass
+    mcp.run()